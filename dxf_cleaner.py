@@ -1,48 +1,178 @@
 #!/usr/bin/env python3
 """
 DXF Cleaner - Extracts entities and layers from DXF files and rebuilds clean versions
-Usage: python dxfclean.py [targetfile.dxf]
+Usage: python dxfclean.py [targetfile.dxf] [more.dxf ...]
 Output: [FILENAME]_cleaned.dxf (now saved in 'Output' subfolder)
+Several files are cleaned in parallel, one worker process per CPU.
 """
 
 import sys
 import os
-import re
-from collections import OrderedDict
-from typing import List, Dict, Tuple, Optional
+import io
+import itertools
+import mmap
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import PurePath
+from typing import List, Dict, Set, Tuple, Optional, Iterator
+
+# Entity types copied into the cleaned file; everything else in ENTITIES is dropped
+_ENTITY_TYPES = frozenset((b"LINE", b"CIRCLE", b"ARC", b"LWPOLYLINE", b"SPLINE", b"ELLIPSE", b"TEXT", b"MTEXT"))
+
+# Bytes of input split into lines per _tokenize step
+_TOKENIZE_BLOCK = 1 << 20
+
+# Buffered output lines per write in build_clean_dxf (roughly 64 KB of DXF text)
+_FLUSH_LINES = 8192
+
+# Where cleaned files are saved, relative to the current working directory
+_OUTPUT_DIR = "Output"
+
+# ProcessPoolExecutor on Windows refuses more than 61 workers
+_MAX_WORKERS = 61
+
+# Codes written by the fixed header of DXFLayer.write_into
+_STD_HEADER_CODES = frozenset(("5", "330", "100", "2", "70"))
+
+# Point in the header template where the generated LAYER table is spliced in
+_LAYER_TABLE_MARKER = "TABLE\n2\nLAYER"
+
+# Layer codes regenerated by DXFLayer.write_into, so they are not captured while parsing
+_LAYER_SKIP_CODES = frozenset((b"5", b"330", b"100", b"70"))
+
+def _decode(raw: bytes) -> str:
+    """Decode a raw DXF line; only called for values that are actually kept"""
+    return raw.decode('utf-8', 'ignore')
+
+# Raw group code -> interned str; drawings use a few dozen distinct codes
+_CODE_STRINGS: Dict[bytes, str] = {}
+
+def _decode_code(raw: bytes) -> str:
+    """Decode a group code, returning the same interned string for every occurrence"""
+    code = _CODE_STRINGS.get(raw)
+    if code is None:
+        code = _CODE_STRINGS[raw] = sys.intern(_decode(raw))
+    return code
+
+def _tokenize(buf, pos: int, end: int) -> Iterator[Tuple[List[bytes], List[bytes]]]:
+    """Split buf[pos:end] into parallel lists of stripped group codes and values.
+
+    Works through the range in blocks of about _TOKENIZE_BLOCK bytes; the line
+    scanning and stripping run in C via bytes.split and map(bytes.strip).
+    """
+    while pos < end:
+        stop = end
+        if pos + _TOKENIZE_BLOCK < end:
+            nl = buf.find(b"\n", pos + _TOKENIZE_BLOCK, end)
+            if nl != -1:
+                stop = nl + 1
+        chunk = buf[pos:stop]
+        lines = chunk.split(b"\n")
+        if chunk.endswith(b"\n"):
+            lines.pop()
+        if len(lines) % 2 and stop < end:
+            # Pull in the value line as well so the next block starts on a code
+            nl = buf.find(b"\n", stop, end)
+            line_end = end if nl == -1 else nl
+            lines.append(buf[stop:line_end])
+            stop = line_end + 1
+        lines = list(map(bytes.strip, lines))
+        yield lines[0::2], lines[1::2] # A dangling code without a value is dropped by zip
+        pos = stop
+        
+def _iter_pairs(buf, pos: int, end: int) -> Iterator[Tuple[bytes, bytes]]:
+    """Yield stripped (code, value) pairs from buf[pos:end], without decoding"""
+    return itertools.chain.from_iterable(zip(codes, values) for codes, values in _tokenize(buf, pos, end))
+
+def _line_bounds(buf, pos: int) -> Tuple[int, int]:
+    """Return the start and end offsets of the line containing pos, excluding the newline"""
+    start = buf.rfind(b"\n", 0, pos) + 1
+    end = buf.find(b"\n", pos)
+    if end == -1:
+        end = len(buf)
+    return start, end
+
+def _previous_line(buf, line_start: int) -> Tuple[int, Optional[bytes]]:
+    """Return the start offset and stripped content of the line before line_start"""
+    if line_start <= 0:
+        return 0, None
+    start = buf.rfind(b"\n", 0, line_start - 1) + 1
+    return start, buf[start:line_start - 1].strip()
+
+def _find_section(buf, name: bytes) -> Optional[Tuple[int, int]]:
+    """Locate the pairs between "0/SECTION/2/<name>" and its "0/ENDSEC" as a byte range"""
+    pos = buf.find(name)
+    while pos != -1:
+        start, end = _line_bounds(buf, pos)
+        if buf[start:end].strip() == name:
+            line_start = start
+            for expected in (b"2", b"SECTION", b"0"):
+                line_start, line = _previous_line(buf, line_start)
+                if line != expected:
+                    break
+            else:
+                body_start = end + 1
+                return body_start, _find_endsec(buf, body_start)
+        pos = buf.find(name, end)
+    return None
+
+def _find_endsec(buf, body_start: int) -> int:
+    """Return the offset of the "0" line closing the section, or the end of buf if it is missing"""
+    pos = buf.find(b"ENDSEC", body_start)
+    while pos != -1:
+        start, end = _line_bounds(buf, pos)
+        if buf[start:end].strip() == b"ENDSEC":
+            code_start, code = _previous_line(buf, start)
+            if code == b"0" and code_start >= body_start:
+                return code_start
+        pos = buf.find(b"ENDSEC", end)
+    return len(buf)
 
 class DXFEntity:
     """Represents a DXF entity with its properties"""
     def __init__(self, entity_type: str):
         self.type = entity_type
-        self.properties = []
+        self.properties = []  # Flat [code, value, code, value, ...]
         self.layer = "0"  # Default layer
+        self._has_handle = False
+        self._handle_value = -1  # Source handle as a number, so generated handles can avoid it
         
     def add_property(self, code: str, value: str):
-        self.properties.append((code, value))
-        # Track layer assignment
+        # Track layer assignment and whether the source gave us a handle
         if code == "8":
-            self.layer = value
+            value = self.layer = sys.intern(value) # Share one string per layer name across entities
+        elif code == "5":
+            self._has_handle = True
+            try:
+                self._handle_value = int(value, 16)
+            except ValueError:
+                pass
+        self.properties.extend((code, value))
             
     def to_dxf(self) -> str:
         """Convert entity back to DXF format"""
-        lines = ["0", self.type]
-        for code, value in self.properties:
-            lines.extend([code, value])
+        lines = []
+        self.write_into(lines)
         return "\n".join(lines)
+        
+    def write_into(self, parts: List[str]):
+        """Append the entity's DXF lines to parts, leaving the join to the caller"""
+        parts.append("0")
+        parts.append(self.type)
+        parts.extend(self.properties)
 
 class DXFLayer:
     """Represents a DXF layer with its properties"""
     def __init__(self, name: str):
         self.name = name
-        self.properties = []  # Store all properties in order
+        self._handle_str = "0"  # Assigned by DXFCleaner when the cleaned file is built
+        self.properties = []  # Store all properties in order, flat [code, value, ...]
         self.color = "7"  # Default white
         self.line_type = "CONTINUOUS"
         self.line_weight = "0"
         
     def add_property(self, code: str, value: str):
         # Store all properties for later replay
-        self.properties.append((code, value))
+        self.properties.extend((code, value))
         # Also track specific properties for reference
         if code == "62":
             self.color = value
@@ -53,90 +183,33 @@ class DXFLayer:
             
     def to_dxf(self) -> str:
         """Convert layer to DXF format - preserving all original properties"""
-        lines = ["0", "LAYER"]
-        
-        # Track which codes we've already output to avoid duplicates
-        output_codes = set()
+        lines = []
+        self.write_into(lines)
+        return "\n".join(lines)
         
-        # First output the standard header codes
-        handle = f"{hash(self.name) % 1000:X}" # Basic unique handle generation
-        standard_header = [
-            ("5", handle),
-            ("330", "2"), # Assuming standard handle for table dictionary
-            ("100", "AcDbSymbolTableRecord"),
-            ("100", "AcDbLayerTableRecord"),
-            ("2", self.name),
-            ("70", "0") # Layer flags
-        ]
+    def write_into(self, lines: List[str]):
+        """Append the layer's DXF lines to lines, leaving the join to the caller"""
+        # First output the standard header codes: handle, owner (assumed standard table
+        # handle 2), subclass markers, name and layer flags
+        lines.append(f"0\nLAYER\n5\n{self._handle_str}\n330\n2\n100\nAcDbSymbolTableRecord\n100\nAcDbLayerTableRecord\n2\n{self.name}\n70\n0")
         
-        for code, value in standard_header:
-            lines.extend([code, value])
-            if code in ["5", "330", "100", "2", "70"]: # Mark these as output
+        # Now replay captured properties, skipping codes the header already output and
+        # repeats of codes already replayed
+        output_codes = set()
+        props = iter(self.properties)
+        for code, value in zip(props, props):
+            if code == "100" or (code not in _STD_HEADER_CODES and code not in output_codes):  # Allow multiple 100 codes
+                lines.append(code)
+                lines.append(value)
                 output_codes.add(code)
         
-        # Now replay all captured properties that aren't already output
-        for code, value in self.properties:
-            if code not in output_codes or code == "100":  # Allow multiple 100 codes
-                lines.extend([code, value])
-                output_codes.add(code) # Mark as output to prevent standard re-output if captured
-        
         # Ensure we have the required 390 code at the end if not already present
         # (some DXF versions might require it for plot style handles)
         if "390" not in output_codes:
             lines.extend(["390", "F"]) # A common default, adjust if needed
-            
-        return "\n".join(lines)
 
-class DXFCleaner:
-    def __init__(self, input_file: str):
-        self.input_file = input_file
-        self.output_file = self._generate_output_filename() ## MODIFIED: This will now point to Output/
-        self.layers: Dict[str, DXFLayer] = OrderedDict()
-        self.entities: List[DXFEntity] = []
-        self.header_template = ""
-        self.footer_template = ""
-        
-    def _generate_output_filename(self) -> str: ## MODIFIED ##
-        """Generate output filename, placing it in the 'Output' subfolder."""
-        # Get the base name of the input file (e.g., "example1.dxf")
-        base_name_with_ext = os.path.basename(self.input_file)
-        # Get the name without extension (e.g., "example1")
-        name_without_ext = os.path.splitext(base_name_with_ext)[0]
-        # Construct the new filename part (e.g., "example1_cleaned.dxf")
-        output_filename_part = f"{name_without_ext}_cleaned.dxf"
-        
-        # Define the output directory relative to the script's Current Working Directory
-        # The batch script will ensure CWD is the root project folder.
-        output_dir_relative_to_cwd = "Output" 
-        
-        # Join them to get the full path for the output file
-        # e.g., "Output/example1_cleaned.dxf"
-        return os.path.join(output_dir_relative_to_cwd, output_filename_part)
-        
-    def load_templates(self):
-        """Load header and footer templates"""
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        
-        header_path = os.path.join(script_dir, "dxf_header_header.txt")
-        if not os.path.exists(header_path):
-            print(f"Error: Header template not found at {header_path}")
-            print("Using minimal header instead.")
-            self.header_template = self._generate_minimal_header()
-        else:
-            with open(header_path, 'r') as f:
-                self.header_template = f.read()
-                
-        footer_path = os.path.join(script_dir, "dxf_footer.txt")
-        if not os.path.exists(footer_path):
-            print(f"Error: Footer template not found at {footer_path}")
-            print("Using minimal footer instead.")
-            self.footer_template = self._generate_minimal_footer()
-        else:
-            with open(footer_path, 'r') as f:
-                self.footer_template = f.read()
-                
-    def _generate_minimal_header(self) -> str:
-        return """999
+# Header used when dxf_header_header.txt is missing; ends at the LAYER table declaration
+_MINIMAL_HEADER = """999
 DXF Cleaner Generated File
 0
 SECTION
@@ -368,9 +441,9 @@ LAYER
 AcDbSymbolTable
 70
 1"""
-    
-    def _generate_minimal_footer(self) -> str:
-        return """ENDSEC
+
+# Footer used when dxf_footer.txt is missing
+_MINIMAL_FOOTER = """ENDSEC
 0
 SECTION
 2
@@ -419,164 +492,44 @@ AcDbPlotSettings
 ENDSEC
 0
 EOF"""
+
+def read_templates() -> Tuple[str, str, bool]:
+    """Read the header and footer templates next to this script, falling back to the minimal ones.
+
+    Returns (header, footer, is_minimal_header).
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    is_minimal_header = False
     
-    def parse_dxf(self):
-        try:
-            with open(self.input_file, 'r', encoding='utf-8', errors='ignore') as f:
-                lines = f.readlines()
-        except Exception as e:
-            print(f"Error reading file: {e}")
-            return False
-            
-        lines = [line.strip() for line in lines]
-        
-        i = 0
-        in_entities_section = False
-        in_blocks_section = False
-        in_tables_section = False
-        in_layer_table = False
-        
-        while i < len(lines):
-            if lines[i] == "0" and i + 1 < len(lines):
-                if lines[i + 1] == "SECTION" and i + 3 < len(lines):
-                    section_name = lines[i + 3]
-                    if section_name == "ENTITIES":
-                        in_entities_section = True
-                        in_blocks_section = False
-                        in_tables_section = False
-                        i += 4
-                        continue
-                    elif section_name == "BLOCKS":
-                        in_blocks_section = True
-                        in_entities_section = False
-                        in_tables_section = False
-                        i += 4
-                        continue
-                    elif section_name == "TABLES":
-                        in_tables_section = True
-                        in_entities_section = False
-                        in_blocks_section = False
-                        i += 4
-                        continue
-                elif lines[i + 1] == "ENDSEC":
-                    in_entities_section = False
-                    in_blocks_section = False
-                    in_tables_section = False
-                    in_layer_table = False
-                    i += 2
-                    continue
-                    
-            if in_tables_section and lines[i] == "0" and i + 1 < len(lines):
-                if lines[i + 1] == "TABLE" and i + 3 < len(lines) and lines[i + 3] == "LAYER":
-                    in_layer_table = True
-                    i += 4
-                    continue
-                elif lines[i + 1] == "ENDTAB":
-                    in_layer_table = False
-                    i += 2
-                    continue
-                    
-            if in_layer_table and lines[i] == "0" and i + 1 < len(lines) and lines[i + 1] == "LAYER":
-                layer = self._parse_layer(lines, i)
-                if layer and layer.name != "0":
-                    self.layers[layer.name] = layer
-                    
-            if in_entities_section and lines[i] == "0" and i + 1 < len(lines):
-                entity_type = lines[i + 1]
-                if entity_type in ["LINE", "CIRCLE", "ARC"]: # Add more entity types if needed
-                    entity = self._parse_entity(lines, i, entity_type)
-                    if entity:
-                        self.entities.append(entity)
-                        
-            i += 1
-            
-        if "0" not in self.layers:
-            default_layer = DXFLayer("0")
-            self.layers["0"] = default_layer
-            
-        print(f"Parsed {len(self.layers)} layers and {len(self.entities)} entities from {self.input_file}")
-        return True
-        
-    def _parse_layer(self, lines: List[str], start_idx: int) -> Optional[DXFLayer]:
-        i = start_idx + 2
-        layer_name = None
-        layer = None
-        
-        while i < len(lines) - 1:
-            code = lines[i]
-            value = lines[i + 1]
-            
-            if code == "0":
-                break
-                
-            if code == "2":
-                layer_name = value
-                layer = DXFLayer(layer_name)
-            elif layer and code not in ["5", "330", "100", "70"]: # Avoid re-adding standard codes we generate
-                layer.add_property(code, value)
-                
-            i += 2
-            
-        return layer
-        
-    def _parse_entity(self, lines: List[str], start_idx: int, entity_type: str) -> Optional[DXFEntity]:
-        entity = DXFEntity(entity_type)
-        i = start_idx + 2
-        
-        while i < len(lines) - 1:
-            code = lines[i]
-            value = lines[i + 1]
+    header_path = os.path.join(script_dir, "dxf_header_header.txt")
+    if not os.path.exists(header_path):
+        print(f"Error: Header template not found at {header_path}")
+        print("Using minimal header instead.")
+        header = _MINIMAL_HEADER
+        is_minimal_header = True
+    else:
+        with open(header_path, 'r') as f:
+            header = f.read()
             
-            if code == "0":
-                break
-                
-            entity.add_property(code, value)
-            i += 2
+    footer_path = os.path.join(script_dir, "dxf_footer.txt")
+    if not os.path.exists(footer_path):
+        print(f"Error: Footer template not found at {footer_path}")
+        print("Using minimal footer instead.")
+        footer = _MINIMAL_FOOTER
+    else:
+        with open(footer_path, 'r') as f:
+            footer = f.read()
             
-        return entity
-        
-    def generate_layer_section(self) -> str:
-        layer_lines = []
-        
-        # Ensure layer 0 is ordered first if it exists, then others
-        sorted_layers = OrderedDict()
-        if "0" in self.layers:
-            sorted_layers["0"] = self.layers["0"]
-        for name, layer in self.layers.items():
-            if name != "0":
-                sorted_layers[name] = layer
+    return header, footer, is_minimal_header
 
-        for name, layer in sorted_layers.items():
-            layer_lines.append(layer.to_dxf())
-                
-        return "\n".join(layer_lines) + "\n0\nENDTAB" # Added missing newline before 0/ENDTAB
-        
-    def build_clean_dxf(self) -> str:
-        header_parts = self.header_template.split("TABLE\n2\nLAYER")
-        dxf_content = ""
-        if len(header_parts) != 2:
-            print("Warning: Header template format unexpected or LAYER table marker not found. Using full template.")
-            # This part needs to correctly insert layer count if format is different
-            # For now, assuming the split works or we rebuild more manually.
-            # A safer approach might be to parse until layer table, insert, then append rest.
-            # For simplicity, using original logic, but this is a fragile point.
-            # Minimal header has "70\n1" for layer count, this needs dynamic update.
-            if "Minimal" in self.header_template: # A bit of a hacky check
-                 self.header_template = self.header_template.replace("70\n1", f"70\n{len(self.layers)}")
-            dxf_content = self.header_template # This would be problematic if LAYER table is in it.
-                                               # For minimal header, it ends just before layer entries.
-        else:
-            # Standard header template should end before actual layer definitions
-            dxf_content = header_parts[0] + "TABLE\n2\nLAYER\n5\n2\n330\n0\n100\nAcDbSymbolTable\n70\n" + str(len(self.layers)) + "\n"
-        
-        dxf_content += self.generate_layer_section()
-        
-        # This is the continuation part of the header/tables after layers
-        # Assuming the original header_template.split worked, header_parts[1] would contain this.
-        # If using minimal_header, it stops at LAYER table declaration.
-        # The following is a fixed block of tables, which is fine.
-        dxf_content += """
-0
+def _output_filename(input_file: str, output_dir: str) -> str:
+    """Return the cleaned file's path for input_file (e.g., Output/example1_cleaned.dxf)"""
+    # Name without directory or extension (e.g., "example1") with the new suffix
+    stem = PurePath(input_file).stem
+    return str(PurePath(output_dir) / f"{stem}_cleaned.dxf")
+
+# Tables following LAYER plus the BLOCKS section, up to the ENTITIES section header
+_STATIC_TABLES_AND_BLOCKS = """0
 TABLE
 2
 STYLE
@@ -963,76 +916,273 @@ ENDSEC
 0
 SECTION
 2
-ENTITIES
-"""
+ENTITIES"""
+
+class DXFCleaner:
+    _created_dirs: Set[str] = set() # Output directories already created by this process
+    
+    def __init__(self, input_file: str):
+        self.input_file = input_file
+        # Output directory relative to the script's Current Working Directory.
+        # The batch script will ensure CWD is the root project folder.
+        self._output_dir = _OUTPUT_DIR
+        self.output_file = self._generate_output_filename() ## MODIFIED: This will now point to Output/
+        self._next_handle = 0x100 # Above the fixed handles used by the templates; raised past source handles in _parse_entities
+        self.layers: Dict[str, DXFLayer] = {}
+        self.layers["0"] = DXFLayer("0") # Layer 0 always comes first; the source's own layer 0 is not copied
+        self.entities: List[DXFEntity] = []
+        self.header_template = ""
+        self.footer_template = ""
+        self._header_pre = ""
+        self._has_layer_marker = False
+        self._is_minimal_header = False # Set when load_templates falls back to _MINIMAL_HEADER
+        
+    def _generate_output_filename(self) -> str: ## MODIFIED ##
+        """Generate output filename, placing it in the 'Output' subfolder."""
+        return _output_filename(self.input_file, self._output_dir)
+        
+    def load_templates(self):
+        """Load header and footer templates, reusing the ones preloaded by main() if set"""
+        templates = _preloaded_templates if _preloaded_templates is not None else read_templates()
+        self.header_template, self.footer_template, self._is_minimal_header = templates
+            
+        # Split once here; build_clean_dxf only needs the part before the LAYER table
+        self._header_pre, marker, _ = self.header_template.partition(_LAYER_TABLE_MARKER)
+        self._has_layer_marker = bool(marker)
+        
+    def parse_dxf(self):
+        try:
+            with open(self.input_file, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    buf = b"" # mmap refuses to map an empty file
+                else:
+                    buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception as e:
+            print(f"Error reading file: {e}")
+            return False
+            
+        try:
+            # Only TABLES and ENTITIES are tokenized; everything else in the file is skipped
+            section_parsers = {b"TABLES": self._parse_tables, b"ENTITIES": self._parse_entities}
+            for section_name, parse_section in section_parsers.items():
+                span = _find_section(buf, section_name)
+                if span:
+                    parse_section(_iter_pairs(buf, *span))
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+                
+        print(f"Parsed {len(self.layers)} layers and {len(self.entities)} entities from {self.input_file}")
+        return True
+        
+    def _allocate_handle(self) -> str:
+        """Return the next unused handle as a hex string"""
+        handle = f"{self._next_handle:X}"
+        self._next_handle += 1
+        return handle
+        
+    def _parse_tables(self, pairs: Iterator[Tuple[bytes, bytes]]):
+        in_layer_table = False
+        table_marker = False # The "2" pair naming the TABLE comes next
+        in_layer_record = False
+        layer = None
+        
+        for code, value in pairs:
+            if code != b"0":
+                if in_layer_record:
+                    if code == b"2":
+                        layer = DXFLayer(_decode(value))
+                    elif layer and code not in _LAYER_SKIP_CODES:
+                        layer.add_property(_decode_code(code), _decode(value))
+                elif table_marker:
+                    in_layer_table = value == b"LAYER"
+                    table_marker = False
+                continue
+                
+            # Every group 0 ends the layer being read and may start another
+            if layer and layer.name != "0":
+                self.layers[layer.name] = layer
+            layer = None
+            in_layer_record = False
+            table_marker = value == b"TABLE"
+            
+            if value == b"ENDTAB":
+                in_layer_table = False
+            elif in_layer_table and value == b"LAYER":
+                in_layer_record = True
+                
+        if layer and layer.name != "0": # Section ended inside a layer record
+            self.layers[layer.name] = layer
+            
+    def _parse_entities(self, pairs: Iterator[Tuple[bytes, bytes]]):
+        entity = None
+        
+        for code, value in pairs:
+            if code == b"0":
+                if value in _ENTITY_TYPES:
+                    entity = DXFEntity(_decode(value))
+                    self.entities.append(entity)
+                else:
+                    entity = None
+            elif entity is not None:
+                entity.add_property(_decode_code(code), _decode(value))
+                
+        # Generated handles must not reuse one kept from the source
+        max_source_handle = max((entity._handle_value for entity in self.entities), default=-1)
+        self._next_handle = max(self._next_handle, max_source_handle + 1)
+        
+    def build_clean_dxf(self, out: io.TextIOBase):
+        """Write the cleaned DXF to out, flushing buffered lines in ~64 KB batches"""
+        parts: List[str] = [] # DXF lines and blocks not yet written, newline-joined on flush
+        if not self._has_layer_marker:
+            print("Warning: Header template format unexpected or LAYER table marker not found. Using full template.")
+            # This part needs to correctly insert layer count if format is different
+            # For now, assuming the split works or we rebuild more manually.
+            # A safer approach might be to parse until layer table, insert, then append rest.
+            # For simplicity, using original logic, but this is a fragile point.
+            # Minimal header has "70\n1" for layer count, this needs dynamic update.
+            if self._is_minimal_header:
+                 self.header_template = self.header_template.replace("70\n1", f"70\n{len(self.layers)}")
+            parts.append(self.header_template.rstrip("\n")) # This would be problematic if LAYER table is in it.
+                                                              # For minimal header, it ends just before layer entries.
+        else:
+            # Standard header template should end before actual layer definitions
+            parts.append(self._header_pre + _LAYER_TABLE_MARKER + "\n5\n2\n330\n0\n100\nAcDbSymbolTable\n70")
+            parts.append(str(len(self.layers)))
+        
+        for layer in self.layers.values():
+            layer._handle_str = self._allocate_handle()
+            layer.write_into(parts)
+        parts.append("0")
+        parts.append("ENDTAB")
+        
+        # This is the continuation part of the header/tables after layers
+        # Assuming the LAYER marker was found in the header template, the part after it would contain this.
+        # If using minimal_header, it stops at LAYER table declaration.
+        # The following is a fixed block of tables, which is fine.
+        parts.append(_STATIC_TABLES_AND_BLOCKS)
         
-        handle_counter = 50 # Starting handle for entities, simple hex counter
         for entity in self.entities:
-            has_handle = False
-            for i, (code, value) in enumerate(entity.properties):
-                if code == "5":
-                    has_handle = True
-                    break
-            if not has_handle:
+            if not entity._has_handle:
                 # Insert handle as the first property after "0" and entity type
-                entity.properties.insert(0, ("5", f"{handle_counter:X}"))
-                handle_counter += 1
+                entity.properties[:0] = ("5", self._allocate_handle())
+                entity._has_handle = True
                 
-            dxf_content += entity.to_dxf() + "\n"
+            entity.write_into(parts)
+            if len(parts) >= _FLUSH_LINES:
+                out.write("\n".join(parts))
+                out.write("\n")
+                parts.clear()
             
-        dxf_content += "0\n" + self.footer_template # Ensures ENDSEC is followed by 0/EOF
-        
-        return dxf_content
+        parts.append("0") # Ensures ENDSEC is followed by 0/EOF
+        parts.append(self.footer_template)
+        out.write("\n".join(parts))
         
-    def save_cleaned_dxf(self, content: str): ## MODIFIED ##
-        """Save the cleaned DXF file, ensuring the output directory exists."""
+    def save_cleaned_dxf(self): ## MODIFIED ##
+        """Stream the cleaned DXF file to disk, ensuring the output directory exists.
+
+        The file is built under a temporary name and only moved into place once
+        complete, so a failed build never leaves a truncated *_cleaned.dxf behind.
+        """
+        temp_file = self.output_file + ".tmp"
         try:
-            # self.output_file now includes the "Output/" prefix
-            output_dir = os.path.dirname(self.output_file)
+            output_dir = self._output_dir
             
             # Create the output directory if it doesn't exist.
             # os.makedirs with exist_ok=True won't raise an error if the directory already exists.
-            # This is safe as f-strings imply Python 3.6+
-            if output_dir: # Ensure output_dir is not an empty string (e.g. if saving to CWD)
+            # Directories already created by an earlier cleaner in this process are skipped.
+            if output_dir and output_dir not in DXFCleaner._created_dirs: # Ensure output_dir is not an empty string (e.g. if saving to CWD)
                 os.makedirs(output_dir, exist_ok=True)
+                DXFCleaner._created_dirs.add(output_dir)
             
-            with open(self.output_file, 'w') as f:
-                f.write(content)
+            with open(temp_file, 'w', buffering=1 << 20) as f:
+                self.build_clean_dxf(f)
+            os.replace(temp_file, self.output_file)
             print(f"Cleaned DXF saved to: {self.output_file}")
             return True
-        except Exception as e:
+        except (OSError, UnicodeError) as e: # Errors from the file system or encoding the output
             print(f"Error saving file: {e}")
             return False
+        finally:
+            # A failed cleanup (e.g., the file is locked on Windows) must not hide the original error
+            try:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+            except OSError as e:
+                print(f"Warning: could not remove temporary file {temp_file}: {e}")
             
     def clean(self):
         print(f"Processing: {self.input_file}")
         self.load_templates()
         if not self.parse_dxf():
             return False
-        clean_content = self.build_clean_dxf()
-        return self.save_cleaned_dxf(clean_content)
-        
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python clean_main.py [targetfile.dxf]")
-        sys.exit(1)
+        return self.save_cleaned_dxf()
         
-    input_file = sys.argv[1]
+# (header, footer, is_minimal_header) read once by main() and shared with the worker processes
+_preloaded_templates: Optional[Tuple[str, str, bool]] = None
+
+def _init_worker(templates: Tuple[str, str, bool]):
+    """Process pool initializer: install the templates read by the parent process"""
+    global _preloaded_templates
+    _preloaded_templates = templates
     
-    if not os.path.exists(input_file):
-        print(f"Error: Input file '{input_file}' not found")
-        sys.exit(1)
-        
-    if not input_file.lower().endswith('.dxf'):
-        print("Error: Input file must be a DXF file")
-        sys.exit(1)
-        
-    cleaner = DXFCleaner(input_file)
-    if cleaner.clean():
+def _clean_file(input_file: str) -> bool:
+    return DXFCleaner(input_file).clean()
+    
+def _report(input_file: str, success: bool):
+    if success:
         print(f"Cleaning of {os.path.basename(input_file)} completed successfully!")
     else:
         print(f"Cleaning of {os.path.basename(input_file)} failed!")
         # sys.exit(1) # Decide if one failure should stop the whole batch
+        
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python dxf_cleaner.py [targetfile.dxf] [more.dxf ...]")
+        sys.exit(1)
+        
+    input_files = sys.argv[1:]
+    
+    for input_file in input_files:
+        if not os.path.exists(input_file):
+            print(f"Error: Input file '{input_file}' not found")
+            sys.exit(1)
+            
+        if not input_file.lower().endswith('.dxf'):
+            print(f"Error: Input file '{input_file}' must be a DXF file")
+            sys.exit(1)
+
+    # Outputs are named after the input's stem only, so two workers could write the same file.
+    # Compare normalised paths: Windows and default macOS volumes ignore case.
+    output_owners: Dict[str, str] = {}
+    for input_file in input_files:
+        output_file = _output_filename(input_file, _OUTPUT_DIR)
+        output_key = os.path.normcase(os.path.abspath(output_file))
+        if sys.platform == "darwin":
+            output_key = output_key.casefold()
+        if output_key in output_owners:
+            print(f"Error: '{output_owners[output_key]}' and '{input_file}' would both be saved to {output_file}")
+            sys.exit(1)
+        output_owners[output_key] = input_file
+
+    if len(input_files) == 1:
+        _report(input_files[0], _clean_file(input_files[0]))
+        return
+        
+    # Read the templates once here rather than once per file in every worker
+    templates = read_templates()
+    
+    workers = min(os.cpu_count() or 1, len(input_files), _MAX_WORKERS)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(templates,)) as pool:
+        futures = {pool.submit(_clean_file, input_file): input_file for input_file in input_files}
+        for future in as_completed(futures):
+            input_file = futures[future]
+            try:
+                success = future.result()
+            except Exception as e:
+                print(f"Error processing {input_file}: {e}")
+                success = False
+            _report(input_file, success)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()